@@ -1,14 +1,39 @@
 from app.internal.secrets import settings
+from kombu import Queue
 
 # Broker Settings
 broker_url = settings.REDIS_URL
+broker_transport_options = {
+    'priority_steps': list(range(10)), # one step per fair share level, 0 is served first
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+
+# Queue Settings -- workers subscribe with -Q so each workload gets its own pool (see docker-compose.yml)
+task_queues = (
+    Queue(settings.SINGLE_URL_QUEUE), # interactive single url requests
+    Queue(settings.BATCH_QUEUE), # batch submissions
+    Queue(settings.RESCORE_QUEUE), # rescoring stored pages, no crawling
+)
+task_default_queue = settings.BATCH_QUEUE
+task_routes = {
+    'app.tasks.rescore_job': {'queue': settings.RESCORE_QUEUE},
+}
 
 # Task Settings
 worker_max_tasks_per_child = 1
 worker_concurrency = 8  # change to 24 to scale
 worker_loglevel = 'info'
+worker_prefetch_multiplier = 1 # crawls run for minutes, a process should not hold jobs another one could start
+task_acks_late = True # ack after the task finishes, not when it starts
+task_reject_on_worker_lost = True # a worker process that died (OOM, SIGKILL) puts its job back on the queue
+task_acks_on_failure_or_timeout = False # same for a job killed by task_time_limit, the attempts cap in scrape_and_store stops loops
 
 # Task Result Settings
+result_backend = settings.RESULT_BACKEND_URL
+result_expires = 60 * 60 * 24 * 7 # keep results for a week
+result_extended = True # store task name and args with the result
 task_track_started = True
 task_time_limit = 480  # 8 minute hard time limit 
-task_soft_time_limit = 360  # 6 minute soft time limit
\ No newline at end of file
+task_soft_time_limit = 360  # 6 minute soft time limit, only a backstop: it can't interrupt the twisted reactor,
+# crawls stop themselves before it at CLOSESPIDER_TIMEOUT (crawler/settings.py) and retry from their checkpoint
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+Single pass link extraction over the parsed lxml tree.
+
+Every <a href> is visited once and resolved against the page's base url, so the anchor
+text, rel and the text around it always belong to the href they are reported with
+(separate `a::attr(href)` and `a::text` passes drift apart as soon as an anchor has no
+direct text). Urls are canonicalized and deduplicated in page order.
+
+w3lib's canonicalize_url dominates the cost on large index pages, so plain relative hrefs
+(unreserved characters only, no query, dot segments or empty segments, the bulk of any
+index) are resolved against the already canonical base by concatenation. Anything else goes
+through resolve_href, `python -m bench.link_extraction` checks both give the same url.
+"""
+from scrapy.http import HtmlResponse
+from scrapy.utils.response import get_base_url
+from w3lib.url import canonicalize_url
+from typing import NamedTuple
+from urllib.parse import urljoin, urlsplit
+import re
+
+CONTEXT_CHARS = 80 # text kept on each side of an anchor
+HTTP_SCHEMES = ("http://", "https://")
+_PLAIN_HREF = re.compile(r"[A-Za-z0-9\-._~/]+")
+
+
+class Link(NamedTuple):
+    url: str # absolute, canonical for http(s) links
+    text: str # anchor text including nested elements, whitespace collapsed
+    rel: str
+    context: str # text right before and after the anchor
+
+
+def canonical_url(url: str) -> str:
+    """ canonical form used to dedupe links and key the link graph, fragments are dropped """
+    if not url.startswith(HTTP_SCHEMES):
+        return url
+    return canonicalize_url(url, keep_fragments=False)
+
+
+def resolve_href(base_url: str, href: str) -> str:
+    """ absolute canonical url of an href, the slow path the resolver's shortcut must agree with """
+    return canonical_url(urljoin(base_url, href.strip()))
+
+
+class _Resolver:
+    """ resolves and canonicalizes the hrefs of one page, each distinct href once """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        canonical_base = urlsplit(canonical_url(base_url))
+        self.http = canonical_base.scheme in ("http", "https")
+        self.origin = f"{canonical_base.scheme}://{canonical_base.netloc}"
+        directory = canonical_base.path[:canonical_base.path.rfind("/") + 1]
+        # urljoin also collapses the base's own empty and dot segments, relative hrefs then take the slow path
+        plain_directory = "//" not in directory and "/." not in directory
+        self.directory = self.origin + directory if plain_directory else None
+        self.resolved: dict[str, str] = {}
+
+    def __call__(self, href: str) -> str:
+        url = self.resolved.get(href)
+        if url is None:
+            url = self.resolved[href] = self._resolve(href)
+        return url
+
+    def _resolve(self, href: str) -> str:
+        path = href.strip().partition("#")[0]
+        # "//" would be a network path or an empty segment that urljoin collapses
+        if self.http and _PLAIN_HREF.fullmatch(path) and "/." not in "/" + path and "//" not in path:
+            prefix = self.origin if path.startswith("/") else self.directory
+            if prefix is not None:
+                return prefix + path
+        return resolve_href(self.base_url, href)
+
+
+def _collapse(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _context(anchor) -> str:
+    previous = anchor.getprevious()
+    if previous is not None:
+        before = previous.tail or ""
+    else:
+        parent = anchor.getparent()
+        before = (parent.text if parent is not None else None) or ""
+    after = anchor.tail or ""
+    return _collapse(f"{before[-CONTEXT_CHARS:]} {after[:CONTEXT_CHARS]}")
+
+
+def extract_links(response: HtmlResponse) -> list[Link]:
+    """
+    Extract the links of a page in document order, one per canonical url.
+    A url linked more than once keeps its first occurrence, with the first non-empty anchor text.
+
+    Returns:
+        list[Link]: The links, non http(s) ones (mailto:, tel:, javascript:) are kept for the caller to filter.
+    """
+    resolve = _Resolver(get_base_url(response))
+    links: dict[str, Link] = {}
+    for anchor in response.selector.root.iter("a"):
+        href = anchor.get("href")
+        if href is None:
+            continue
+        url = resolve(href)
+        seen = links.get(url)
+        if seen is not None and seen.text:
+            continue
+        text = _collapse("".join(anchor.itertext()))
+        if seen is None:
+            links[url] = Link(url, text, anchor.get("rel", ""), _context(anchor))
+        elif text:
+            links[url] = seen._replace(text=text)
+    return list(links.values())
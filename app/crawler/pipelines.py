@@ -1,14 +1,42 @@
-class ResultCollectorPipeline:
+from app.internal.models import TargetPage
+from app.internal import metrics
+from datetime import datetime
+import uuid
+
+
+class CheckpointPipeline:
     """
-    Pipeline that collects all scraped items in a list,
+    Pipeline that stores each item as soon as it is scored and marks its url done,
+    so a job killed or retried halfway keeps the pages it already paid for
     """
-    def __init__(self):
-        self.items = []
-    
     def process_item(self, item, spider):
-        self.items.append(item)
+        checkpoint = getattr(spider, 'checkpoint', None)
+        if checkpoint is None:
+            return item
+        target = None
+        if item["relevance_score"] > 1: #filter out noise immediately
+            target = TargetPage(
+                id=uuid.uuid4(),
+                job_uid=checkpoint.job_uid,
+                target_url=item["url"],
+                file_type=item["file_type"],
+                relevance_score=item["relevance_score"],
+                matched_keywords=item["keywords"],
+                created_at=datetime.utcnow()
+            )
+        else:
+            metrics.ITEMS_DROPPED.labels(reason="low_relevance").inc()
+        checkpoint.complete(item["frontier_url"], target, item["text"])
+        return item
+
+
+class LinkGraphPipeline:
+    """
+    Pipeline that stores each item's score on the site's link graph,
+    so later jobs on the site know which targets are worth revisiting
+    """
+    def process_item(self, item, spider):
+        link_graph = getattr(spider, 'link_graph', None)
+        if link_graph is not None:
+            link_graph.score(item["frontier_url"], item["relevance_score"])
         return item
-        
-    def close_spider(self, spider):
-        spider.collected_items = self.items
-    
\ No newline at end of file
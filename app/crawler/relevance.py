@@ -0,0 +1,57 @@
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
+from app.internal.secrets import settings
+from app.internal import metrics
+from scrapy.utils.project import get_project_settings
+import time
+
+# completion errors that are likely to pass, the task retries instead of failing
+TRANSIENT_LLM_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class RelevanceScorer:
+    """
+    Scores extracted text against a set of keywords with the completions api.
+    Shared by the spider and the rescore task so both rank pages the same way.
+    """
+
+    spider_settings = get_project_settings()
+
+    def __init__(self, target_keywords=None, chat_client=None):
+        self.target_keywords = target_keywords or self.spider_settings.get('DEFAULT_TARGET_KEYWORDS')
+        self.chat_client = chat_client or OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.llm_seconds = 0.0 # time spent waiting on completions
+
+    def rank_relevance(self, text, url):
+        prompt = (
+        f"Given the following text and the url it came from, rate if it contains content relevant to these keywords: {self.target_keywords}.\n"
+        "Return ONLY a single float number between 1 and 10, where 10 is most relevant and 1 is least relevant. NOT ALL THE TEXT HAS TO BE RELEVANT TO THE KEYWORDS, only some\n"
+        f"Text: {text}\n"
+        f"URL: {url}"
+        )
+        model = self.spider_settings.get('GPT_MODEL')
+        start = time.perf_counter()
+        response = self.chat_client.completions.create(
+            model=model,
+            prompt=prompt,
+            temperature=0.2,
+            max_tokens=self.spider_settings.get('GPT_MAX_TOKENS')
+        )
+        elapsed = time.perf_counter() - start
+        metrics.LLM_LATENCY.labels(model=model).observe(elapsed)
+        self.llm_seconds += elapsed
+        self.record_usage(model, response.usage)
+        return float(response.choices[0].text.strip()) if response.choices else -1.0 #placeholder
+
+    def record_usage(self, model, usage):
+        if usage is None:
+            return
+        metrics.LLM_TOKENS.labels(model=model, kind="prompt").inc(usage.prompt_tokens)
+        metrics.LLM_TOKENS.labels(model=model, kind="completion").inc(usage.completion_tokens)
+        cost = (
+            usage.prompt_tokens * self.spider_settings.getfloat('GPT_PROMPT_COST_PER_1K')
+            + usage.completion_tokens * self.spider_settings.getfloat('GPT_COMPLETION_COST_PER_1K')
+        ) / 1000
+        metrics.LLM_COST.labels(model=model).inc(cost)
+
+    def extract_keywords(self, text):
+        return [kw for kw in self.target_keywords if kw.lower() in text.lower()]
@@ -6,27 +6,49 @@ from scrapy.utils.project import get_project_settings
 
 
 
-def run_spider(start_url:str,target_keywords:list): 
+def run_spider(start_url:str,target_keywords:list,job_uid): 
     """Spider abstraction to run the high value link spider
     Args:
         start_url (str): The URL to start the spider from.
         target_keywords (list[str]): A list of keywords to search for in the text.
+        job_uid (uuid.UUID): The job to checkpoint progress for, items are stored as they are scraped.
+
+    Returns:
+        tuple[dict[str, float], list[str]]: The spider's per stage timings in seconds
+            and the transient errors that should make the job retry.
     """
 
     spider_settings = get_project_settings()
 
     process = CrawlerProcess(settings=spider_settings)
-    results = [] # simple list to hold our scraping results 
+    timings = {}
+    transient_errors = []
+
+    def crawler_results(spider, reason):
+        timings.update(getattr(spider, 'timings', {}))
+        if getattr(spider, 'checkpoint', None):
+            timings["db_flush"] = spider.checkpoint.flush_seconds
+        transient_errors.extend(getattr(spider, 'transient_errors', []))
+        if reason == "closespider_timeout": # ran out of time, the rest of the frontier is left for the retry
+            transient_errors.append(f"crawl stopped after CLOSESPIDER_TIMEOUT ({spider_settings.getint('CLOSESPIDER_TIMEOUT')}s)")
+
+    def callback_error(failure, response, spider):
+        spider.callback_failed(failure, response.meta.get('frontier_url'))
+
+    def pipeline_error(item, response, spider, failure):
+        spider.callback_failed(failure, item.get('frontier_url'))
 
-    def crawler_results(spider):
-        if hasattr(spider, 'collected_items'):
-            results.extend(spider.collected_items)
+    def request_dropped(request, spider):
+        spider.request_dropped(request)
 
     dispatcher.connect(crawler_results, signal=signals.spider_closed)
+    dispatcher.connect(callback_error, signal=signals.spider_error)
+    dispatcher.connect(pipeline_error, signal=signals.item_error)
+    dispatcher.connect(request_dropped, signal=signals.request_dropped)
 
-    process.crawl(HighValueLinkSpider,start_url=start_url,target_keywords=target_keywords)
+    process.crawl(HighValueLinkSpider,start_url=start_url,target_keywords=target_keywords,job_uid=job_uid)
 
 
     process.start()
 
-    return results
\ No newline at end of file
+    return timings, transient_errors
\ No newline at end of file
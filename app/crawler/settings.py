@@ -2,16 +2,23 @@ BOT_NAME = 'crawler'
 SPIDER_MODULES = ['app.crawler.spiders']
 NEWSPIDER_MODULE = 'app.crawler.spiders'
 ITEM_PIPELINES = {
-    'app.crawler.pipelines.ResultCollectorPipeline': 100, #collector pipeline
+    'app.crawler.pipelines.LinkGraphPipeline': 40, # scores the edges leading to each item, before the url is marked done
+    'app.crawler.pipelines.CheckpointPipeline': 50, # stores each item as it is scraped
 }
 DEPTH_LIMIT = 2 # only go 1 links deep, can be configured
 DOWNLOAD_DELAY = 0.1 # delay between requests
 DOWNLOAD_TIMEOUT = 1 # delay between requests
+CLOSESPIDER_TIMEOUT = 300 # seconds, below celery's task_soft_time_limit so a long crawl stops cleanly and the job retries from its checkpoint
 ROBOTSTXT_OBEY = True
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
 IGNORED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.css', '.js']
+LINK_GRAPH_REUSE = True # later jobs on a walked site go straight to its known good targets
+LINK_GRAPH_MAX_AGE_DAYS = 7 # after this the seed page is walked again to find new links
+LINK_GRAPH_MIN_SCORE = 5.0 # relevance a known target needs to be revisited
 GPT_MODEL = "gpt-3.5-turbo-instruct"
 GPT_MAX_TOKENS = 17
+GPT_PROMPT_COST_PER_1K = 0.0015 # USD, used for the llm cost metric
+GPT_COMPLETION_COST_PER_1K = 0.002
 DEFAULT_TARGET_KEYWORDS = [
     "Budget", "ACFR", "Finance Director", "CFO", "Financial Report",
     "Expenditure", "Revenue", "General Fund", "Capital Improvement Plan",
@@ -1,14 +1,24 @@
 import scrapy
 from scrapy.http import HtmlResponse
-from openai import OpenAI
-from app.internal.secrets import settings
 import mimetypes
-from urllib.parse import urljoin
+from datetime import timedelta
 import trafilatura
 from scrapy.spiders import CrawlSpider
 from scrapy.utils.project import get_project_settings
+from app.crawler.links import canonical_url, extract_links
+from app.crawler.relevance import RelevanceScorer, TRANSIENT_LLM_ERRORS
+from app.internal import metrics
+from app.internal.checkpoint import JobCheckpoint
+from app.internal.link_graph import LinkGraph
+from sqlalchemy.exc import OperationalError
+from twisted.internet.error import ConnectionRefusedError, DNSLookupError, TCPTimedOutError, TimeoutError
+from twisted.web._newclient import ResponseNeverReceived
+import time
 
 
+# errors worth retrying the whole job for, the job then resumes from its checkpoint
+TRANSIENT_NETWORK_ERRORS = (TimeoutError, TCPTimedOutError, DNSLookupError, ConnectionRefusedError, ResponseNeverReceived)
+TRANSIENT_STORAGE_ERRORS = (OperationalError,) # database locked or unreachable
 
 # ! fix this entire file
 
@@ -18,82 +28,170 @@ class HighValueLinkSpider(CrawlSpider):
     
     spider_settings = get_project_settings()
 
-    def __init__(self, start_url, target_keywords=None, *args, **kwargs):
+    def __init__(self, start_url, target_keywords=None, job_uid=None, *args, **kwargs):
         self.start_urls = [start_url] # maybe it can do multiple at a time? or would it be better 1 per celery task 
-        self.chat_client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        self.target_keywords = target_keywords or self.spider_settings.get('DEFAULT_TARGET_KEYWORDS')
+        self.scorer = RelevanceScorer(target_keywords)
+        self.target_keywords = self.scorer.target_keywords
+        self.timings = {"fetch": 0.0, "extraction": 0.0, "llm": 0.0} # per job breakdown in seconds, saved on the SourcePage
+        self.checkpoint = JobCheckpoint(job_uid) if job_uid else None
+        self.transient_errors = [] # failures that should make the task retry
+        self.link_graph = LinkGraph(canonical_url(start_url), self.target_keywords)
         super(HighValueLinkSpider,self).__init__(**kwargs)
 
 
     def start_requests(self):
+        pending = self.checkpoint.pending_urls() if self.checkpoint else None
+        if pending is not None:
+            # resumed job: the seed page was already walked, only crawl what is left of its frontier
+            self.logger.info("resuming with %d of the frontier left", len(pending))
+            for url in pending:
+                yield self.link_request(url)
+            return
+        known = self.known_targets()
+        if known:
+            # seed walked recently with these keywords: skip it and revisit its good targets
+            self.logger.info("going straight to %d known targets of %s", len(known), self.link_graph.seed_url)
+            if self.checkpoint:
+                self.checkpoint.save_frontier(known)
+            for url in known:
+                yield self.link_request(url)
+            return
         for url in self.start_urls:
-            yield scrapy.Request(url=url, callback=self.parse)
+            yield scrapy.Request(url=url, callback=self.parse, errback=self.seed_failed)
+
+    def known_targets(self):
+        if not self.spider_settings.getbool('LINK_GRAPH_REUSE'):
+            return []
+        return self.link_graph.known_targets(
+            min_score=self.spider_settings.getfloat('LINK_GRAPH_MIN_SCORE'),
+            max_age=timedelta(days=self.spider_settings.getfloat('LINK_GRAPH_MAX_AGE_DAYS'))
+        )
+
+    def link_request(self, url):
+        return scrapy.Request(url=url, callback=self.parse_link, errback=self.link_failed, meta={'frontier_url': url})
+
+    def seed_failed(self, failure):
+        if failure.check(*TRANSIENT_NETWORK_ERRORS):
+            self.transient_errors.append(f"{failure.request.url}: {failure.getErrorMessage()}")
+
+    def link_failed(self, failure):
+        # scrapy already retried network errors, a target that still fails is skipped rather than retrying the job
+        metrics.ITEMS_DROPPED.labels(reason="fetch_error").inc()
+        self.mark_done(failure.request.meta['frontier_url'])
+
+    def callback_failed(self, failure, frontier_url=None):
+        """ an exception escaped a callback or a pipeline, hooked to spider_error and item_error in run_spider """
+        if frontier_url is None or failure.check(*TRANSIENT_STORAGE_ERRORS):
+            # the seed page is the whole job, and a page that could not be stored is left undone for the retry
+            self.transient_errors.append(f"{frontier_url or self.start_urls[0]}: {failure.getErrorMessage()}")
+            return
+        # a bug or a bad completion on that page, retrying would fail the same way
+        metrics.ITEMS_DROPPED.labels(reason="error").inc()
+        self.mark_done(frontier_url)
+
+    def request_dropped(self, request):
+        """ the scheduler filtered a duplicate, e.g. a frontier url redirecting to a page already crawled """
+        frontier_url = request.meta.get('frontier_url')
+        if frontier_url is not None:
+            metrics.ITEMS_DROPPED.labels(reason="duplicate").inc()
+            self.mark_done(frontier_url)
+
+    def mark_done(self, url):
+        if self.checkpoint:
+            self.checkpoint.complete(url)
+
+    def record_fetch(self, response: HtmlResponse, callback: str):
+        latency = response.meta.get('download_latency')
+        if latency is not None:
+            metrics.FETCH_LATENCY.labels(callback=callback).observe(latency)
+            self.timings["fetch"] += latency
+        if 'cached' in response.flags:
+            metrics.CACHE_HITS.labels(cache="http").inc()
 
     def parse(self, response: HtmlResponse):
-        links = response.css('a::attr(href)').getall()
-        link_texts = response.css('a::text').getall()
-        for link, text in zip(links, link_texts):
-            if not self.should_follow_link(link, text):
+        self.record_fetch(response, "parse")
+        page_url = canonical_url(response.url)
+        followed = []
+        for link in extract_links(response): # absolute, canonical and deduplicated
+            if link.url == page_url:
+                metrics.LINKS_FILTERED.labels(reason="self").inc()
                 continue
-            absolute_link = urljoin(response.url, link)
-            yield scrapy.Request(url=absolute_link, callback=self.parse_link)
-           
+            if self.should_follow_link(link.url, link.text):
+                followed.append(link)
+        self.link_graph.record(followed) # under the seed url, even if it redirected
+        frontier = [link.url for link in followed]
+        if self.checkpoint:
+            self.checkpoint.save_frontier(frontier)
+        for url in frontier:
+            yield self.link_request(url)
+
 
     def parse_link(self, response: HtmlResponse):
-        
+        self.record_fetch(response, "parse_link")
+
+        start = time.perf_counter()
         extracted_text = trafilatura.extract(response.text)
-        text = extracted_text[:4000] # cap to 4000 so it doesent overwhelm chat
-        relevance_score = self.rank_relevance(text,response.url)
+        elapsed = time.perf_counter() - start
+        metrics.EXTRACTION_TIME.observe(elapsed)
+        self.timings["extraction"] += elapsed
+        if not extracted_text:
+            metrics.ITEMS_DROPPED.labels(reason="no_text").inc()
+            self.mark_done(response.meta['frontier_url'])
+            return
+        try:
+            relevance_score = self.rank_relevance(extracted_text[:4000],response.url) # cap to 4000 so it doesent overwhelm chat
+        except TRANSIENT_LLM_ERRORS as e:
+            # left undone in the checkpoint, the retried job scores it again
+            self.transient_errors.append(f"{response.url}: {e}")
+            return
         yield {
             "url": response.url,
+            "frontier_url": response.meta['frontier_url'],
             "relevance_score": relevance_score,
             "file_type": self.guess_file_type(response),
-            "keywords": self.extract_keywords(text),
-            "text":text
+            "keywords": self.extract_keywords(extracted_text),
+            "text":extracted_text # stored uncapped
         }
 
     def rank_relevance(self, text,url):
-        prompt = (
-        f"Given the following text and the url it came from, rate if it contains content relevant to these keywords: {self.target_keywords}.\n"
-        "Return ONLY a single float number between 1 and 10, where 10 is most relevant and 1 is least relevant. NOT ALL THE TEXT HAS TO BE RELEVANT TO THE KEYWORDS, only some\n"
-        f"Text: {text}\n"
-        f"URL: {url}" 
-        )
-        response = self.chat_client.completions.create(
-            model=self.spider_settings.get('GPT_MODEL'),
-            prompt=prompt,
-            temperature=0.2,
-            max_tokens=self.spider_settings.get('GPT_MAX_TOKENS')
-        )
-        f = float(response.choices[0].text.strip()) if response.choices else -1.0 #placeholder
-        print(f)
+        f = self.scorer.rank_relevance(text, url)
+        self.timings["llm"] = self.scorer.llm_seconds
+        self.logger.debug("relevance %s for %s", f, url)
         return f
 
     def extract_keywords(self, text): 
-        return [kw for kw in self.target_keywords if kw.lower() in text.lower()]
+        return self.scorer.extract_keywords(text)
     
     def guess_file_type(self,response: HtmlResponse):
         file_type, encoding = mimetypes.guess_type(response.url)
         return file_type or "html"
     
     def should_follow_link(self, link, anchor_text):
+        reason = self.filter_reason(link, anchor_text)
+        if reason is None:
+            return True
+        metrics.LINKS_FILTERED.labels(reason=reason).inc()
+        return False
+
+    def filter_reason(self, link, anchor_text):
+        """ returns why a link should be skipped, or None if it should be followed """
         # skip ignored extensions
         if any(link.endswith(ext) for ext in self.spider_settings.get('IGNORED_EXTENSIONS', [])):
-            return False
-        if link.startswith('#') or link.startswith('mailto:') or link.startswith('tel:'):
-            return False
+            return "extension"
+        if not link.startswith(('http://', 'https://')): # mailto:, tel:, javascript: and the like
+            return "scheme"
         # skip links with certain keywords in the anchor text
         skip_words = [
             "login", "sign in", "register", "privacy", "terms", "contact", "about", "faq",
             "help", "support", "cookie", "accessibility", "sitemap", "feedback"
         ]
         if anchor_text and any(word in anchor_text.lower() for word in skip_words):
-            return False
+            return "anchor_text"
         # skip links that look like navigation or social media
         nav_patterns = ["facebook.com", "twitter.com", "linkedin.com", "instagram.com", "youtube.com"]
         if any(pattern in link for pattern in nav_patterns):
-            return False
+            return "social"
         #  skip links with lots of query params (often not content)
         if link.count('?') > 1:
-            return False
-        return True
\ No newline at end of file
+            return "query"
+        return None
\ No newline at end of file
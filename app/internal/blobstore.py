@@ -0,0 +1,139 @@
+"""
+Content addressed store for extracted page text.
+
+Texts are keyed by the sha256 of their content, so identical pages found by different
+jobs are stored once, and compressed with zstd. A dictionary trained on the corpus
+(python -m app.internal.blobstore train) makes the short, boilerplate heavy texts we
+extract compress considerably better than they would on their own. Every blob records
+the dictionary it was compressed with, so older blobs stay readable after retraining.
+"""
+from sqlmodel import Session, select
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from app.internal.models import CompressionDict, PageText
+import hashlib
+import zstandard
+
+COMPRESSION_LEVEL = 9
+DICT_SIZE = 112 * 1024 # zstd's recommended ~100KB
+MIN_TRAINING_SAMPLES = 100
+TRAINING_SAMPLE_LIMIT = 5000
+NO_DICT = 0
+
+_dicts: dict[int, zstandard.ZstdCompressionDict] = {}
+_compressors: dict[int, zstandard.ZstdCompressor] = {}
+_decompressors: dict[int, zstandard.ZstdDecompressor] = {}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _dictionary(session: Session, dict_id: int) -> zstandard.ZstdCompressionDict | None:
+    if dict_id == NO_DICT:
+        return None
+    if dict_id not in _dicts:
+        row = session.get(CompressionDict, dict_id)
+        _dicts[dict_id] = zstandard.ZstdCompressionDict(row.data)
+    return _dicts[dict_id]
+
+
+def _compressor(session: Session, dict_id: int) -> zstandard.ZstdCompressor:
+    if dict_id not in _compressors:
+        _compressors[dict_id] = zstandard.ZstdCompressor(
+            level=COMPRESSION_LEVEL,
+            dict_data=_dictionary(session, dict_id)
+        )
+    return _compressors[dict_id]
+
+
+def _decompressor(session: Session, dict_id: int) -> zstandard.ZstdDecompressor:
+    if dict_id not in _decompressors:
+        _decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=_dictionary(session, dict_id))
+    return _decompressors[dict_id]
+
+
+def latest_dict_id(session: Session) -> int:
+    return session.exec(select(func.max(CompressionDict.id))).one() or NO_DICT
+
+
+def put_text(session: Session, text: str) -> str:
+    """
+    Store a text unless it is already stored, in the session's transaction, the caller commits.
+    Jobs storing the same text at the same time both succeed, the first insert wins.
+
+    Returns:
+        str: The hash to reference the text by.
+    """
+    digest = text_hash(text)
+    if session.get(PageText, digest) is None:
+        dict_id = latest_dict_id(session)
+        session.exec(insert(PageText).values(
+            hash=digest,
+            data=_compressor(session, dict_id).compress(text.encode()),
+            dict_id=dict_id,
+            size=len(text)
+        ).on_conflict_do_nothing(index_elements=["hash"]))
+    return digest
+
+
+def get_texts(session: Session, hashes) -> dict[str, str]:
+    """ decompress the texts for the given hashes, missing ones are left out """
+    hashes = {h for h in hashes if h}
+    if not hashes:
+        return {}
+    rows = session.exec(select(PageText).where(PageText.hash.in_(hashes))).all()
+    return {
+        row.hash: _decompressor(session, row.dict_id).decompress(row.data).decode()
+        for row in rows
+    }
+
+
+def get_text(session: Session, digest: str | None) -> str | None:
+    return get_texts(session, [digest]).get(digest)
+
+
+def delete_orphans(session: Session, referenced):
+    """
+    Delete texts no longer referenced by any target page. Added to the session, the caller commits.
+
+    Args:
+        referenced: Select of the text hashes still in use.
+    """
+    session.exec(PageText.__table__.delete().where(PageText.hash.not_in(referenced)))
+
+
+def train_dictionary(session: Session, samples: list[str] | None = None) -> int | None:
+    """
+    Train a new dictionary, on the given texts or a sample of the stored ones.
+    Only texts stored afterwards use it, existing blobs keep theirs.
+
+    Returns:
+        int | None: The new dictionary id, None if there were too few samples to train on.
+    """
+    if samples is None:
+        rows = session.exec(
+            select(PageText).order_by(PageText.hash).limit(TRAINING_SAMPLE_LIMIT)
+        ).all()
+        samples = [_decompressor(session, row.dict_id).decompress(row.data).decode() for row in rows]
+    if len(samples) < MIN_TRAINING_SAMPLES:
+        return None
+    try:
+        trained = zstandard.train_dictionary(DICT_SIZE, [sample.encode() for sample in samples])
+    except zstandard.ZstdError: # corpus too small or uniform for the requested size
+        return None
+    row = CompressionDict(data=trained.as_bytes())
+    session.add(row)
+    session.commit()
+    return row.id
+
+
+if __name__ == "__main__":
+    import sys
+    from app.internal.db_setup import engine
+
+    if sys.argv[1:] != ["train"]:
+        sys.exit("usage: python -m app.internal.blobstore train")
+    with Session(engine) as session:
+        dict_id = train_dictionary(session)
+    print(f"trained dictionary {dict_id}" if dict_id else "not enough stored texts to train on")
@@ -0,0 +1,139 @@
+"""
+Read-through cache for api responses.
+
+Responses are serialized once with orjson and kept in an in-process LRU, backed by Redis so
+every api process shares them. Each entry carries a strong ETag, clients revalidating with
+If-None-Match get a 304 without a body.
+
+Invalidation is generational: keys embed a generation number stored in Redis, and bumping
+it (job finished, rows deleted, database reset) orphans every cached entry at once. The
+generation is re-read from Redis at most every GENERATION_CHECK_INTERVAL seconds, so
+a change made by a worker is visible to the api within that interval.
+"""
+from fastapi import Request, Response
+from app.internal.secrets import settings
+from app.internal import metrics
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import orjson
+import redis
+import threading
+import time
+
+GENERATION_KEY = "raven:cache:generation"
+GENERATION_CHECK_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+
+    @classmethod
+    def from_payload(cls, payload) -> "CachedResponse":
+        body = orjson.dumps(payload)
+        return cls(body=body, etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+
+    def matches(self, if_none_match: str | None) -> bool:
+        if not if_none_match:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+    def to_response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"} # clients may keep it but must revalidate
+        if self.matches(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl # seconds entries live in Redis
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._generation_checked = 0.0
+        self._redis = None
+
+    def _client(self) -> redis.Redis | None:
+        if self._redis is None and settings.REDIS_URL:
+            self._redis = redis.Redis.from_url(settings.REDIS_URL)
+        return self._redis
+
+    def generation(self) -> int:
+        now = time.monotonic()
+        if now - self._generation_checked >= GENERATION_CHECK_INTERVAL and self._client():
+            try:
+                self._generation = int(self._client().get(GENERATION_KEY) or 0)
+            except redis.RedisError: # keep serving with the last known generation
+                pass
+            self._generation_checked = now
+        return self._generation
+
+    def key(self, route: str, **params) -> str:
+        """ cache key for a route and its parsed parameters, so defaults and ordering don't matter """
+        normalized = orjson.dumps(
+            {name: value for name, value in params.items() if value is not None},
+            option=orjson.OPT_SORT_KEYS,
+            default=str
+        )
+        return f"raven:cache:{self.generation()}:{route}:{normalized.decode()}"
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                metrics.CACHE_HITS.labels(cache="response_memory").inc()
+                return entry
+        if not self._client():
+            return None
+        try:
+            stored = self._client().hgetall(key)
+        except redis.RedisError:
+            return None
+        if not stored:
+            return None
+        entry = CachedResponse(body=stored[b"body"], etag=stored[b"etag"].decode())
+        self._remember(key, entry)
+        metrics.CACHE_HITS.labels(cache="response_redis").inc()
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        self._remember(key, entry)
+        if not self._client():
+            return
+        try:
+            pipe = self._client().pipeline()
+            pipe.hset(key, mapping={"body": entry.body, "etag": entry.etag})
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def _remember(self, key: str, entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """ drop every cached response, in this process right away and in others within GENERATION_CHECK_INTERVAL """
+        with self._lock:
+            self._entries.clear()
+        if self._client():
+            try:
+                self._generation = self._client().incr(GENERATION_KEY)
+                self._generation_checked = time.monotonic()
+                return
+            except redis.RedisError:
+                pass
+        self._generation += 1
+
+
+response_cache = ResponseCache(max_entries=settings.CACHE_MAX_ENTRIES, ttl=settings.CACHE_TTL)
@@ -0,0 +1,75 @@
+from sqlmodel import Session, select
+from sqlalchemy import update
+from app.internal.db_setup import engine
+from app.internal.models import CrawlFrontier, TargetPage
+from app.internal import metrics, blobstore
+from contextlib import contextmanager
+import time
+import uuid
+
+
+class JobCheckpoint:
+    """
+    Durable progress of a crawl job.
+
+    The frontier (links found on the seed page) is saved once, and every frontier url is
+    marked done in the same transaction that stores its TargetPage. A retried or redelivered
+    task loads the pending urls and skips both the seed page and the pages already scored.
+    """
+
+    def __init__(self, job_uid: uuid.UUID):
+        self.job_uid = job_uid
+        self.flush_seconds = 0.0 # time spent writing, reported in the job timings
+
+    def pending_urls(self) -> list[str] | None:
+        """
+        Returns:
+            list[str] | None: urls of the frontier still to be crawled, None if no frontier was saved yet.
+        """
+        with Session(engine) as session:
+            rows = session.exec(select(CrawlFrontier).where(CrawlFrontier.job_uid == self.job_uid)).all()
+        if not rows:
+            return None
+        return [row.url for row in rows if not row.done]
+
+    def save_frontier(self, urls: list[str]):
+        with self._timed(), Session(engine) as session:
+            known = set(session.exec(select(CrawlFrontier.url).where(CrawlFrontier.job_uid == self.job_uid)).all())
+            for url in dict.fromkeys(urls):
+                if url not in known:
+                    session.add(CrawlFrontier(job_uid=self.job_uid, url=url))
+            session.commit()
+
+    def complete(self, url: str, target: TargetPage | None = None, text: str | None = None):
+        """
+        mark a frontier url as done, storing its target page (and its text in the blobstore)
+        unless the job already has one for that url
+        """
+        with self._timed(), Session(engine) as session:
+            if target is not None:
+                existing = session.exec(
+                    select(TargetPage.id).where(
+                        TargetPage.job_uid == self.job_uid,
+                        TargetPage.target_url == target.target_url
+                    )
+                ).first()
+                if existing is None:
+                    if text:
+                        target.text_hash = blobstore.put_text(session, text)
+                    session.add(target)
+            session.exec(
+                update(CrawlFrontier)
+                .where(CrawlFrontier.job_uid == self.job_uid, CrawlFrontier.url == url)
+                .values(done=True)
+            )
+            session.commit()
+
+    @contextmanager
+    def _timed(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.DB_FLUSH_TIME.observe(elapsed)
+            self.flush_seconds += elapsed
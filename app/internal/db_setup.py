@@ -1,17 +1,123 @@
 from sqlmodel import SQLModel, create_engine, Session
-from sqlalchemy import delete
-from app.internal.models import SourcePage, TargetPage
+from sqlalchemy import delete, inspect, text
+from app.internal.models import SourcePage, TargetPage, CrawlFrontier, PageText, LinkEdge
+from app.internal.secrets import settings
+from app.internal import blobstore
+from contextlib import contextmanager
+import fcntl
+import sys
 
 
 
-engine = create_engine("sqlite:///app/database.db") # should be swapped for postgresql in production
-SQLModel.metadata.create_all(engine)
+engine = create_engine(settings.DATABASE_URL) # should be swapped for postgresql in production
+
+
+@contextmanager
+def schema_lock():
+    """ serializes schema changes between the processes sharing the sqlite file """
+    database = engine.url.database
+    if engine.url.get_backend_name() != "sqlite" or not database or database == ":memory:":
+        yield
+        return
+    with open(f"{database}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def add_missing_columns():
+    """
+    create_all only creates missing tables, so nullable columns added to a model
+    after its table was created are added here
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+
+
+def add_missing_indexes():
+    """ create_all also skips indexes declared on tables that already exist """
+    inspector = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name == "ix_targetpage_job_uid_target_url":
+                deduplicate_target_pages()
+            index.create(engine)
+
+
+def deduplicate_target_pages():
+    """ keep the first row per (job_uid, target_url) so the unique index can be built """
+    with engine.begin() as conn:
+        conn.execute(text(
+            "DELETE FROM targetpage WHERE rowid NOT IN "
+            "(SELECT MIN(rowid) FROM targetpage GROUP BY job_uid, target_url)"
+        ))
+
+
+def move_text_to_blobstore():
+    """
+    Databases created before the blobstore keep page text inline in targetpage.
+    Trains a dictionary on that text, moves it into pagetext and drops the column.
+    """
+    inspector = inspect(engine)
+    if "text" not in {column["name"] for column in inspector.get_columns("targetpage")}:
+        return
+    with Session(engine) as session:
+        rows = session.exec(text("SELECT id, text FROM targetpage WHERE text IS NOT NULL")).all()
+        if blobstore.latest_dict_id(session) == blobstore.NO_DICT:
+            blobstore.train_dictionary(session, [row.text for row in rows])
+        for row in rows:
+            digest = blobstore.put_text(session, row.text)
+            session.exec(text("UPDATE targetpage SET text_hash = :digest WHERE id = :id").bindparams(digest=digest, id=row.id))
+        session.commit()
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE targetpage DROP COLUMN text"))
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM")) # give the freed pages back
+
+
+def migrate():
+    """
+    Bring a database created by an older version up to the current models.
+    Run once before the api and the workers start (the migrate service in docker-compose.yml),
+    every step checks the schema first so running it again is a no-op.
+    """
+    with schema_lock():
+        SQLModel.metadata.create_all(engine)
+        add_missing_columns()
+        add_missing_indexes()
+        move_text_to_blobstore()
+
+
+with schema_lock(): # importing only creates missing tables, so a fresh database works without migrating
+    SQLModel.metadata.create_all(engine)
 
 def reset_db():
     with Session(engine) as session:
+        session.exec(delete(CrawlFrontier))
         session.exec(delete(SourcePage))
         session.exec(delete(TargetPage))
+        session.exec(delete(PageText))
+        session.exec(delete(LinkEdge))
         session.commit()
 
 if __name__=="__main__":
-    reset_db()
\ No newline at end of file
+    if sys.argv[1:] == ["migrate"]:
+        migrate()
+    else:
+        reset_db()
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+Fair-share scheduling between tenants sharing a queue.
+
+Each tenant (api key) has a count of outstanding jobs in Redis. A job is submitted with a
+priority that grows with the number of jobs its tenant already has queued, so a tenant
+with a 10k url batch sinks to the back while a tenant with a handful of urls is served
+next. The Redis transport is configured with one priority step per level (celeryconfig),
+0 is served first.
+"""
+from app.internal.secrets import settings
+import hashlib
+import redis
+
+MAX_PRIORITY = 9
+KEY_TTL = 60 * 60 * 24 # set when a counter is created, not refreshed, so a count leaked by a lost job heals within a day
+
+_client = None
+
+
+def redis_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def tenant_id(api_key: str | None) -> str:
+    """ jobs without an api key share one tenant, keys are hashed so they are never stored """
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def _key(tenant: str) -> str:
+    return f"raven:fair-share:{tenant}"
+
+
+def reserve(tenant: str, count: int = 1) -> list[int]:
+    """
+    Count `count` new jobs against the tenant.
+
+    Returns:
+        list[int]: The priority to submit each job with, in submission order.
+    """
+    pipe = redis_client().pipeline()
+    pipe.set(_key(tenant), 0, ex=KEY_TTL, nx=True) # INCRBY keeps the expiry of an existing counter
+    pipe.incrby(_key(tenant), count)
+    outstanding = pipe.execute()[1] - count
+    step = settings.FAIR_SHARE_STEP
+    return [min(MAX_PRIORITY, (outstanding + i) // step) for i in range(count)]
+
+
+def release(tenant: str | None):
+    """ called once a job reached its final state """
+    if not tenant:
+        return
+    key = _key(tenant)
+    if redis_client().decr(key) <= 0:
+        redis_client().delete(key)
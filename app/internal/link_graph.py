@@ -0,0 +1,94 @@
+"""
+Per-site graph of the links jobs followed, and how the pages behind them scored.
+
+The first job on a seed url walks the seed page, records every followed link as an edge
+(anchor text, rel and surrounding text included) and scores the targets. Later jobs on
+the same seed url, with the same keywords and while its edges are younger than
+LINK_GRAPH_MAX_AGE, go straight to the targets that scored at least LINK_GRAPH_MIN_SCORE
+instead of walking the seed page again. Scores are shared across the site, a target
+reached from several seeds carries its latest score on every edge.
+"""
+from sqlmodel import Session, select
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+from app.internal.db_setup import engine
+from app.internal.models import LinkEdge
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import hashlib
+
+UPSERT_BATCH_SIZE = 500 # rows per statement, stays under sqlite's bound parameter limit
+
+
+def site_domain(url: str) -> str:
+    return urlparse(url).netloc.lower().removeprefix("www.")
+
+
+def keywords_hash(keywords) -> str:
+    """ scores are only comparable between jobs ranking against the same keywords """
+    return hashlib.sha256("\n".join(sorted(kw.lower() for kw in keywords)).encode()).hexdigest()[:16]
+
+
+class LinkGraph:
+
+    def __init__(self, seed_url: str, target_keywords):
+        self.seed_url = seed_url # canonical, edges walked from it are recorded under it
+        self.domain = site_domain(seed_url)
+        self.scored_for = keywords_hash(target_keywords)
+
+    def known_targets(self, min_score: float, max_age: timedelta) -> list[str]:
+        """
+        Returns:
+            list[str]: Targets linked from this seed that scored at least `min_score` for these keywords,
+            best first. Empty if the seed was never walked or its edges are older than `max_age`.
+        """
+        with Session(engine) as session:
+            rows = session.exec(
+                select(LinkEdge.target_url).where(
+                    LinkEdge.domain == self.domain,
+                    LinkEdge.source_url == self.seed_url,
+                    LinkEdge.scored_for == self.scored_for,
+                    LinkEdge.relevance_score >= min_score,
+                    LinkEdge.last_seen >= datetime.utcnow() - max_age
+                ).order_by(LinkEdge.relevance_score.desc())
+            ).all()
+        return list(dict.fromkeys(rows))
+
+    def record(self, links):
+        """ upsert the edges from the walked seed page, refreshing the ones seen before but keeping their scores """
+        now = datetime.utcnow()
+        rows = [
+            {
+                "domain": self.domain,
+                "source_url": self.seed_url,
+                "target_url": link.url,
+                "anchor_text": link.text,
+                "rel": link.rel,
+                "context": link.context,
+                "last_seen": now,
+            }
+            for link in links
+        ]
+        with Session(engine) as session:
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                statement = insert(LinkEdge).values(rows[start:start + UPSERT_BATCH_SIZE])
+                session.exec(statement.on_conflict_do_update(
+                    index_elements=["domain", "source_url", "target_url"],
+                    set_={
+                        "anchor_text": statement.excluded.anchor_text,
+                        "rel": statement.excluded.rel,
+                        "context": statement.excluded.context,
+                        "last_seen": statement.excluded.last_seen,
+                    }
+                ))
+            session.commit()
+
+    def score(self, target_url: str, relevance_score: float):
+        """ store the latest score of a target on every edge leading to it """
+        with Session(engine) as session:
+            session.exec(
+                update(LinkEdge)
+                .where(LinkEdge.domain == self.domain, LinkEdge.target_url == target_url)
+                .values(relevance_score=relevance_score, scored_for=self.scored_for)
+            )
+            session.commit()
@@ -0,0 +1,146 @@
+"""
+Prometheus metrics shared by the spider, pipelines, celery tasks and the api.
+
+Celery recycles its worker processes after every crawl (worker_max_tasks_per_child=1),
+so the worker must run with PROMETHEUS_MULTIPROC_DIR set for samples recorded in the
+child processes to survive them. The api process uses the default registry.
+When a child exits its counter and histogram files are folded into one aggregate file per
+type, so the directory stays the same size however many crawls the worker has run.
+"""
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.mmap_dict import MmapedDict
+from collections import defaultdict
+import fcntl
+import os
+
+# seconds buckets tuned for crawl work: sub-second fetches up to multi-minute jobs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+FETCH_LATENCY = Histogram(
+    "raven_fetch_latency_seconds",
+    "Time spent downloading a page",
+    ["callback"],
+    buckets=LATENCY_BUCKETS,
+)
+EXTRACTION_TIME = Histogram(
+    "raven_extraction_seconds",
+    "Time spent extracting the main text of a page",
+    buckets=LATENCY_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "raven_llm_latency_seconds",
+    "Time spent waiting on relevance completions",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "raven_llm_tokens_total",
+    "Tokens consumed by relevance completions",
+    ["model", "kind"],  # kind -- prompt, completion
+)
+LLM_COST = Counter(
+    "raven_llm_cost_usd_total",
+    "Estimated spend on relevance completions in USD",
+    ["model"],
+)
+DB_FLUSH_TIME = Histogram(
+    "raven_db_flush_seconds",
+    "Time spent writing crawl results to the database",
+    buckets=LATENCY_BUCKETS,
+)
+JOB_DURATION = Histogram(
+    "raven_job_duration_seconds",
+    "End to end duration of a scrape_and_store task",
+    ["status"],
+    buckets=LATENCY_BUCKETS,
+)
+LINKS_FILTERED = Counter(
+    "raven_links_filtered_total",
+    "Links on seed pages that were not followed, by reason",
+    ["reason"],
+)
+CACHE_HITS = Counter(
+    "raven_cache_hits_total",
+    "Cache hits, by cache",
+    ["cache"],
+)
+ITEMS_DROPPED = Counter(
+    "raven_items_dropped_total",
+    "Scraped items that were not stored, by reason",
+    ["reason"],
+)
+REQUEST_LATENCY = Histogram(
+    "raven_http_request_seconds",
+    "Latency of api requests",
+    ["method", "route", "status_code"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def multiprocess_enabled() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def collector_registry() -> CollectorRegistry:
+    """
+    Registry to expose: aggregates every process' samples when running multiprocess,
+    otherwise the default in-process registry.
+    """
+    if not multiprocess_enabled():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def start_exporter(port: int):
+    """ serve /metrics on its own port, used by the celery worker which has no web server """
+    start_http_server(port, registry=collector_registry())
+
+
+def mark_process_dead(pid: int):
+    """ drop live gauges of a recycled worker process and fold its counters and histograms into the aggregates """
+    if not multiprocess_enabled():
+        return
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    multiprocess.mark_process_dead(pid, path)
+    # not a .db file, the collector would try to read it
+    with open(os.path.join(path, "aggregate.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX) # processes exiting at the same time would lose each other's samples
+        for typ in ("counter", "histogram"):
+            fold_into_aggregate(path, typ, pid)
+
+
+def fold_into_aggregate(path: str, typ: str, pid: int):
+    """
+    Add the samples of a dead process to `{typ}_aggregate.db` and remove its file.
+    Counter values and histogram buckets are both stored as plain per process totals, so
+    samples are summed key by key.
+    """
+    dead = os.path.join(path, f"{typ}_{pid}.db")
+    if not os.path.exists(dead):
+        return
+    aggregate = os.path.join(path, f"{typ}_aggregate.db")
+    totals = defaultdict(float)
+    for filename in (aggregate, dead):
+        if os.path.exists(filename):
+            for key, value, _, _ in MmapedDict.read_all_values_from_file(filename):
+                totals[key] += value
+    staged = os.path.join(path, f"{typ}_aggregate.staged")
+    if os.path.exists(staged):
+        os.remove(staged) # left by a process killed mid fold
+    merged = MmapedDict(staged)
+    try:
+        for key, value in totals.items():
+            merged.write_value(key, value, 0.0)
+    finally:
+        merged.close()
+    os.replace(staged, aggregate) # a scrape sees either the old or the new aggregate
+    os.remove(dead)
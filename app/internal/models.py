@@ -1,8 +1,8 @@
 from sqlmodel import Field, SQLModel, Relationship
 import uuid
-from typing import Optional, List
+from typing import Optional, List, Dict
 from sqlalchemy.dialects.sqlite import JSON
-from sqlalchemy import Column
+from sqlalchemy import Column, Index, LargeBinary
 from datetime import datetime
 
 
@@ -10,19 +10,57 @@ from datetime import datetime
 class SourcePage(SQLModel,table=True):
     uid: uuid.UUID = Field(nullable=False, primary_key=True)
     url: str 
-    status: str = Field(default="PENDING") # -- SUCCESS, FAILURE, PENDING, COMPLETED derived from celery status 
+    status: str = Field(default="PENDING") # -- PENDING, RETRYING, COMPLETE, FAILED
+    attempts: Optional[int] = Field(default=0) # runs of the task, including retries and redeliveries after a worker was killed
     created_at: datetime = Field(default_factory=datetime.utcnow())
+    timings: Optional[Dict[str, float]] = Field(default=None, sa_column=Column(JSON)) # seconds per stage: fetch, extraction, llm, crawl, db_flush
     targets: List["TargetPage"] = Relationship(back_populates="source") 
 
 
 class TargetPage(SQLModel,table=True):
+    __table_args__ = (
+        Index("ix_targetpage_job_uid_target_url", "job_uid", "target_url", unique=True), # resumed jobs must not duplicate rows
+    )
     id: uuid.UUID = Field(nullable=False, primary_key=True)
     job_uid: uuid.UUID = Field(foreign_key="sourcepage.uid")  
     target_url: str
     file_type: str
     relevance_score: float
     matched_keywords: List[str] = Field(sa_column=Column(JSON))
-    text: Optional[str] = Field(default=None) 
+    text_hash: Optional[str] = Field(default=None, foreign_key="pagetext.hash") # full text lives in PageText, loaded only when needed
     created_at: datetime = Field(default_factory=datetime.utcnow())
-    source: Optional[SourcePage] = Relationship(back_populates="targets") 
- 
\ No newline at end of file
+    source: Optional[SourcePage] = Relationship(back_populates="targets")
+
+
+class CrawlFrontier(SQLModel,table=True):
+    """ links a job has discovered, so a retried job resumes without refetching completed pages """
+    job_uid: uuid.UUID = Field(foreign_key="sourcepage.uid", primary_key=True)
+    url: str = Field(primary_key=True)
+    done: bool = Field(default=False)
+
+
+class PageText(SQLModel,table=True):
+    """ zstd compressed extracted text, content addressed so jobs finding the same page share it """
+    hash: str = Field(primary_key=True) # sha256 of the uncompressed text
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    dict_id: int = Field(default=0) # CompressionDict it was compressed with, 0 for none
+    size: int # uncompressed length
+
+
+class CompressionDict(SQLModel,table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class LinkEdge(SQLModel,table=True):
+    """ link followed from a seed page, kept across jobs so later jobs on the seed can go straight to the good targets """
+    domain: str = Field(primary_key=True) # host of the seed url, lowercase
+    source_url: str = Field(primary_key=True) # canonical seed url
+    target_url: str = Field(primary_key=True)
+    anchor_text: str = Field(default="")
+    rel: str = Field(default="")
+    context: str = Field(default="")
+    relevance_score: Optional[float] = Field(default=None) # latest score of the target, None until it was scored
+    scored_for: Optional[str] = Field(default=None) # hash of the keywords the score was given for
+    last_seen: datetime = Field(default_factory=datetime.utcnow)
@@ -6,6 +6,15 @@ load_dotenv()
 class Settings:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     REDIS_URL = os.getenv("REDIS_URL")
+    RESULT_BACKEND_URL = os.getenv("RESULT_BACKEND_URL", REDIS_URL)
+    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app/database.db")
+    SINGLE_URL_QUEUE = os.getenv("SINGLE_URL_QUEUE", "interactive") # queue each endpoint submits to
+    BATCH_QUEUE = os.getenv("BATCH_QUEUE", "batch")
+    RESCORE_QUEUE = os.getenv("RESCORE_QUEUE", "rescore")
+    FAIR_SHARE_STEP = int(os.getenv("FAIR_SHARE_STEP", "50")) # outstanding jobs per priority level a tenant drops
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048")) # api responses kept in process memory
+    CACHE_TTL = int(os.getenv("CACHE_TTL", "3600")) # seconds api responses are kept in redis
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9808")) # worker side prometheus exporter
 
 settings = Settings()
 
@@ -1,13 +1,19 @@
-from fastapi import FastAPI, Depends, HTTPException, Query, Path, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Path, Request, status
 from fastapi.responses import JSONResponse
-from app.tasks import scrape_and_store
+from app.tasks import scrape_and_store, rescore_job, app as celery_app
+from celery.exceptions import TimeLimitExceeded
 from celery.result import AsyncResult
-from app.internal.db_setup import engine, SourcePage, TargetPage
-from sqlmodel import Session, select, delete, or_, and_
+from app.internal.db_setup import engine, SourcePage, TargetPage, CrawlFrontier, PageText, LinkEdge
+from sqlmodel import Session, select, delete, func, and_
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel, HttpUrl
 from uuid import UUID
+from prometheus_client import make_asgi_app
+from app.internal import metrics, fair_share, blobstore
+from app.internal.cache import CachedResponse, response_cache
+from app.internal.secrets import settings
+import time
 
 # Response models for better documentation
 class TaskResponse(BaseModel):
@@ -23,6 +29,7 @@ class SourcePageResponse(BaseModel):
     url: str
     status: str
     created_at: datetime
+    timings: Optional[Dict[str, float]] = None
 
 class TargetPageResponse(BaseModel):
     id: UUID
@@ -43,25 +50,68 @@ class BatchScrapeRequest(BaseModel):
     urls: List[HttpUrl]
     target_keywords: Optional[List[str]] = None
 
+class RescoreRequest(BaseModel):
+    target_keywords: Optional[List[str]] = None
+
 
-def add_tasks(urls: List[str], target_keywords: List[str]) -> List[AsyncResult]:
+def add_tasks(urls: List[str], target_keywords: List[str], queue: str, tenant: str) -> List[AsyncResult]:
     """
     Add scraping tasks to the Celery queue and return task results.
 
     Args:
         urls (List[str]): List of URLs to scrape.
         target_keywords (Optional[List[str]]): Optional list of keywords to prioritize during scraping.
+        queue (str): Queue to route the tasks to, each endpoint has its own (see celeryconfig).
+        tenant (str): Tenant the tasks are counted against for fair share priorities.
 
     Returns:
         List[AsyncResult]: List of task results corresponding to the scraping jobs.
     """
     results = []
-    for url in urls:
-        result: AsyncResult = scrape_and_store.delay(url, target_keywords)
+    priorities = fair_share.reserve(tenant, len(urls))
+    for url, priority in zip(urls, priorities):
+        result: AsyncResult = scrape_and_store.apply_async(
+            args=[url, target_keywords],
+            kwargs={"tenant": tenant},
+            queue=queue,
+            priority=priority
+        )
         results.append(result)
     return results
 
 
+TERMINAL_STATUSES = ("COMPLETE", "FAILED") # jobs whose rows won't change anymore, safe to cache
+
+SEARCH_BATCH_SIZE = 500 # candidate rows decompressed at a time by the search endpoint
+SEARCH_SCAN_LIMIT = 5000 # candidate rows whose text a search decompresses at most
+SEARCH_MAX_RESULTS = 100
+
+# celery states that say more than a PENDING/RETRYING row in the database
+BACKEND_STATUSES = {
+    "FAILURE": "FAILED",
+    "REVOKED": "FAILED",
+    "RETRY": "RETRYING",
+    "SUCCESS": "COMPLETE",
+}
+
+
+def backend_status(task_id: str) -> Optional[str]:
+    """
+    Look the task up in the celery result backend.
+
+    Returns:
+        Optional[str]: The job status implied by the task state, None if it adds nothing to the database status.
+    """
+    try:
+        result = AsyncResult(task_id, app=celery_app)
+        state = result.state
+        if state == "FAILURE" and isinstance(result.result, TimeLimitExceeded):
+            return "RETRYING" # killed by task_time_limit, the message was put back on the queue
+    except Exception: # backend unreachable, fall back to the database status
+        return None
+    return BACKEND_STATUSES.get(state)
+
+
 def get_session():
     """
     Create and yield a database session.
@@ -76,6 +126,22 @@ app = FastAPI(
     version="1.0.0",
 )
 
+app.mount("/metrics", make_asgi_app(registry=metrics.collector_registry()))
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    if route is not None: # unmatched paths would explode label cardinality
+        metrics.REQUEST_LATENCY.labels(
+            method=request.method,
+            route=route.path,
+            status_code=response.status_code
+        ).observe(time.perf_counter() - start)
+    return response
+
 @app.post(
     "/api/tasks/urls/single",
     response_model=TaskResponse,
@@ -83,19 +149,24 @@ app = FastAPI(
     tags=["Tasks"],
     summary="Submit a single URL for scraping"
 )
-async def submit_scrape(request: ScrapeUrlRequest, session: Session = Depends(get_session)):
+async def submit_scrape(
+    request: ScrapeUrlRequest,
+    x_api_key: Optional[str] = Header(None, description="Identifies the tenant for fair share scheduling"),
+    session: Session = Depends(get_session)
+):
     """
-    Submit a single URL to be scraped.
+    Submit a single URL to be scraped. Routed to the interactive queue so it is not stuck behind batches.
     
     Args:
         request (ScrapeUrlRequest): Request object containing the URL and optional target keywords.
+        x_api_key (Optional[str]): API key of the tenant submitting the job.
         session (Session): Database session dependency.
     
     Returns:
         TaskResponse: Contains the task ID and initial status.
     """
     # start the Celery task 
-    result = scrape_and_store.delay(str(request.url), request.target_keywords)
+    [result] = add_tasks([str(request.url)], request.target_keywords, settings.SINGLE_URL_QUEUE, fair_share.tenant_id(x_api_key))
     
     return {"task_id": result.id, "status": "PENDING"}
 
@@ -108,54 +179,104 @@ async def submit_scrape(request: ScrapeUrlRequest, session: Session = Depends(ge
     tags=["Tasks"],
     summary="Submit a batch of URLs for scraping"
 )
-async def submit_batch_scrape(request: BatchScrapeRequest):
+async def submit_batch_scrape(
+    request: BatchScrapeRequest,
+    x_api_key: Optional[str] = Header(None, description="Identifies the tenant for fair share scheduling")
+):
     """
     Submit a batch of URLs to be scraped in parallel.
+    The more jobs a tenant already has queued, the lower the priority of the new ones.
     
     Args:
         request (BatchScrapeRequest): Request object containing list of URLs and optional target keywords.
+        x_api_key (Optional[str]): API key of the tenant submitting the jobs.
     
     Returns:
         BatchTaskResponse: Contains list of task IDs and count of jobs submitted.
     """
     url_strings = [str(url) for url in request.urls]
-    results = add_tasks(url_strings, request.target_keywords)
+    results = add_tasks(url_strings, request.target_keywords, settings.BATCH_QUEUE, fair_share.tenant_id(x_api_key))
     task_ids = [task.id for task in results]
     return {"task_ids": task_ids, "count": len(task_ids)}
 
 
 @app.get("/api/tasks/{task_id}")
 async def get_task_status(
+    request: Request,
     task_id: str = Path(..., description="The ID of the scraping task"),
     session: Session = Depends(get_session)
 ):
     try:
         uid_obj = UUID(task_id)        
-        source_page = session.exec(
-            select(SourcePage).where(SourcePage.uid == uid_obj)
-        ).first()
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
-    
-    if not source_page:
-        return {
-            "task_id": task_id,
-            "status": "PENDING"  
-        }
+    cache_key = response_cache.key("get_task_status", task_id=uid_obj)
+    cached = response_cache.get(cache_key)
+    if cached:
+        return cached.to_response(request)
+    source_page = session.exec(
+        select(SourcePage).where(SourcePage.uid == uid_obj)
+    ).first()
+
+    status = source_page.status if source_page else "PENDING"
+    if status in ("PENDING", "RETRYING"):
+        # the row lags behind jobs that were killed or are still queued
+        status = backend_status(task_id) or status
+
     response = {
         "task_id": task_id,
-        "status": source_page.status
+        "status": status
     }
-    if source_page.status == "COMPLETED":
-        target_pages = session.exec(
-            select(TargetPage).where(TargetPage.job_uid == source_page.uid)
-        ).all()
+    if source_page and source_page.status == "COMPLETE":
+        target_count = session.exec(
+            select(func.count()).select_from(TargetPage).where(TargetPage.job_uid == source_page.uid)
+        ).one()
         response["result"] = {
             "url": source_page.url,
-            "scraped_at": source_page.scraped_at,
-            "target_count": len(target_pages)
+            "scraped_at": source_page.created_at,
+            "target_count": target_count
         }
-    return response
+    entry = CachedResponse.from_payload(response)
+    if source_page and source_page.status in TERMINAL_STATUSES: # a status only reported by the backend can still change
+        response_cache.put(cache_key, entry)
+    return entry.to_response(request)
+
+
+@app.post(
+    "/api/tasks/{task_id}/rescore",
+    response_model=TaskResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Tasks"],
+    summary="Rescore the target pages of a finished job"
+)
+async def submit_rescore(
+    request: RescoreRequest,
+    task_id: str = Path(..., description="The ID of the scraping task to rescore"),
+    session: Session = Depends(get_session)
+):
+    """
+    Rank the target pages a job stored again against new keywords, without crawling.
+    Runs on the rescore queue, check on it with the returned task ID.
+    
+    Args:
+        request (RescoreRequest): Request object containing the optional target keywords.
+        task_id (str): The ID of the scraping task whose pages are rescored.
+        session (Session): Database session dependency.
+    
+    Returns:
+        TaskResponse: Contains the rescore task ID and initial status.
+        
+    Raises:
+        HTTPException: If the job is not found.
+    """
+    try:
+        uid_obj = UUID(task_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    if not session.get(SourcePage, uid_obj):
+        raise HTTPException(status_code=404, detail="Source page not found")
+    result = rescore_job.apply_async(args=[str(uid_obj), request.target_keywords], queue=settings.RESCORE_QUEUE)
+    return {"task_id": result.id, "status": "PENDING"}
 
 
 @app.get(
@@ -165,7 +286,7 @@ async def get_task_status(
     summary="Get all source pages"
 )
 async def list_source_pages(
-    status: Optional[str] = Query(None, description="Filter by status (PENDING, COMPLETED, FAILURE)"),
+    status: Optional[str] = Query(None, description="Filter by status (PENDING, RETRYING, COMPLETE, FAILED)"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of records to return"),
     offset: int = Query(0, ge=0, description="Number of records to skip"),
     session: Session = Depends(get_session)
@@ -198,13 +319,15 @@ async def list_source_pages(
     summary="Get a specific source page"
 )
 async def get_source_page(
+    request: Request,
     page_uid: str = Path(..., description="UUID of the source page"),
     session: Session = Depends(get_session)
 ):
     """
-    Get details of a specific source page by its UUID.
+    Get details of a specific source page by its UUID. Cached once the job is finished.
     
     Args:
+        request (Request): The incoming request, for If-None-Match.
         page_uid (str): The UUID of the source page.
         session (Session): Database session dependency.
     
@@ -216,10 +339,17 @@ async def get_source_page(
     """
     try:
         uid_obj = UUID(page_uid)
+        cache_key = response_cache.key("get_source_page", page_uid=uid_obj)
+        cached = response_cache.get(cache_key)
+        if cached:
+            return cached.to_response(request)
         page = session.exec(select(SourcePage).where(SourcePage.uid == uid_obj)).first()
         if not page:
             raise HTTPException(status_code=404, detail="Source page not found")
-        return page
+        entry = CachedResponse.from_payload(SourcePageResponse.model_validate(page, from_attributes=True).model_dump())
+        if page.status in TERMINAL_STATUSES:
+            response_cache.put(cache_key, entry)
+        return entry.to_response(request)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
 
@@ -231,6 +361,7 @@ async def get_source_page(
     summary="Get all target pages with optional filtering"
 )
 async def list_target_pages(
+    request: Request,
     file_type: Optional[str] = Query(None, description="Filter by file type (e.g., 'text/html', 'application/pdf')"),
     min_relevance: Optional[float] = Query(None, ge=0, le=10, description="Minimum relevance score (0-10)"),
     keyword: Optional[str] = Query(None, description="Filter by matched keyword"),
@@ -241,8 +372,11 @@ async def list_target_pages(
 ):
     """
     Retrieve target pages with optional filtering by various criteria.
+    Listings of a single finished job are cached until it is rescored or data is deleted,
+    others change while jobs run and are always read fresh.
     
     Args:
+        request (Request): The incoming request, for If-None-Match.
         file_type (Optional[str]): Filter pages by file type.
         min_relevance (Optional[float]): Filter pages by minimum relevance score.
         keyword (Optional[str]): Filter pages that contain a specific keyword.
@@ -254,6 +388,25 @@ async def list_target_pages(
     Returns:
         List[TargetPageResponse]: List of filtered target pages.
     """
+    uid_obj = None
+    if source_uid:
+        try:
+            uid_obj = UUID(source_uid)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid UUID format")
+        cache_key = response_cache.key(
+            "list_target_pages",
+            file_type=file_type,
+            min_relevance=min_relevance,
+            keyword=keyword,
+            source_uid=uid_obj,
+            limit=limit,
+            offset=offset
+        )
+        cached = response_cache.get(cache_key)
+        if cached:
+            return cached.to_response(request)
+
     query = select(TargetPage)
     filters = []
     
@@ -266,18 +419,21 @@ async def list_target_pages(
     if keyword:
         filters.append(TargetPage.matched_keywords.contains([keyword]))
     
-    if source_uid:
-        try:
-            uid_obj = UUID(source_uid)
-            filters.append(TargetPage.job_uid == uid_obj)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid UUID format")
+    if uid_obj:
+        filters.append(TargetPage.job_uid == uid_obj)
     
     if filters:
         query = query.where(and_(*filters))
     
     pages = session.exec(query.offset(offset).limit(limit)).all()
-    return pages
+    entry = CachedResponse.from_payload([
+        TargetPageResponse.model_validate(page, from_attributes=True).model_dump() for page in pages
+    ])
+    if uid_obj:
+        source_page = session.get(SourcePage, uid_obj)
+        if source_page and source_page.status in TERMINAL_STATUSES: # its rows won't change anymore
+            response_cache.put(cache_key, entry)
+    return entry.to_response(request)
 
 
 @app.get(
@@ -287,13 +443,15 @@ async def list_target_pages(
     summary="Get a specific target page"
 )
 async def get_target_page(
+    request: Request,
     page_id: str = Path(..., description="UUID of the target page"),
     session: Session = Depends(get_session)
 ):
     """
-    Get details of a specific target page by its UUID.
+    Get details of a specific target page by its UUID. Cached until data is deleted.
     
     Args:
+        request (Request): The incoming request, for If-None-Match.
         page_id (str): The UUID of the target page.
         session (Session): Database session dependency.
     
@@ -305,10 +463,19 @@ async def get_target_page(
     """
     try:
         id_obj = UUID(page_id)
+        cache_key = response_cache.key("get_target_page", page_id=id_obj)
+        cached = response_cache.get(cache_key)
+        if cached:
+            return cached.to_response(request)
         page = session.exec(select(TargetPage).where(TargetPage.id == id_obj)).first()
         if not page:
             raise HTTPException(status_code=404, detail="Target page not found")
-        return page
+        entry = CachedResponse.from_payload(TargetPageResponse(
+            **page.model_dump(),
+            text=blobstore.get_text(session, page.text_hash) # only the detail and search endpoints load text
+        ).model_dump())
+        response_cache.put(cache_key, entry)
+        return entry.to_response(request)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
 
@@ -338,24 +505,48 @@ async def search_target_pages(
     """
     query = select(TargetPage).where(TargetPage.relevance_score >= min_score)
     
-    filters = []
-    
-    filters.append(or_(
-        TargetPage.text.contains(q),
-        TargetPage.matched_keywords.contains([q])
-    ))
-    
     if file_types:
-        filters.append(TargetPage.file_type.in_(file_types))
-    
-    if filters:
-        query = query.where(and_(*filters))
-    
-    results = session.exec(query.limit(100)).all()
+        query = query.where(TargetPage.file_type.in_(file_types))
+    query = query.order_by(TargetPage.relevance_score.desc(), TargetPage.id)
+
+    # keyword matches are found in SQL
+    keyword = func.json_each(TargetPage.matched_keywords).table_valued("value")
+    results = session.exec(
+        query.where(select(keyword.c.value).where(keyword.c.value == q).exists()).limit(SEARCH_MAX_RESULTS)
+    ).all()
+
+    # text is stored compressed, so the most relevant candidates are decompressed and matched here,
+    # at most SEARCH_SCAN_LIMIT of them
+    needle = q.lower()
+    found = {page.id for page in results}
+    scanned = 0
+    while len(results) < SEARCH_MAX_RESULTS and scanned < SEARCH_SCAN_LIMIT:
+        candidates = session.exec(
+            query.offset(scanned).limit(min(SEARCH_BATCH_SIZE, SEARCH_SCAN_LIMIT - scanned))
+        ).all()
+        if not candidates:
+            break
+        scanned += len(candidates)
+        texts = blobstore.get_texts(session, [page.text_hash for page in candidates])
+        for page in candidates:
+            text = texts.get(page.text_hash)
+            if page.id not in found and text and needle in text.lower():
+                results.append(page)
+                found.add(page.id)
+                if len(results) == SEARCH_MAX_RESULTS:
+                    break
+    partial = scanned >= SEARCH_SCAN_LIMIT and len(results) < SEARCH_MAX_RESULTS
+
+    texts = blobstore.get_texts(session, [page.text_hash for page in results])
+    snippets = {}
+    for page in results:
+        text = texts.get(page.text_hash)
+        snippets[page.id] = text[:200] + "..." if text and len(text) > 200 else text
     
     return {
         "query": q,
         "count": len(results),
+        "partial": partial,
         "min_score": min_score,
         "file_types": file_types,
         "results": [
@@ -365,7 +556,7 @@ async def search_target_pages(
                 "relevance_score": page.relevance_score,
                 "file_type": page.file_type,
                 "matched_keywords": page.matched_keywords,
-                "snippet": page.text[:200] + "..." if page.text and len(page.text) > 200 else page.text
+                "snippet": snippets[page.id]
             }
             for page in results
         ]
@@ -442,8 +633,12 @@ async def reset_database(session: Session = Depends(get_session)):
         Response with 200 on success.
     """
     session.exec(delete(TargetPage))
+    session.exec(delete(CrawlFrontier))
     session.exec(delete(SourcePage))
+    session.exec(delete(PageText))
+    session.exec(delete(LinkEdge))
     session.commit()
+    response_cache.invalidate()
     return JSONResponse(content={"message": "Successfully deleted all data in database"}, status_code=200)
 
 
@@ -475,14 +670,19 @@ async def delete_source_page(
         
         
         session.exec(delete(TargetPage).where(TargetPage.job_uid == uid_obj))
+        session.exec(delete(CrawlFrontier).where(CrawlFrontier.job_uid == uid_obj))
         
         
         result = session.exec(delete(SourcePage).where(SourcePage.uid == uid_obj))
         
         if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="Source page not found")
+        
+        # texts are shared between jobs, only drop the ones nothing references anymore
+        blobstore.delete_orphans(session, select(TargetPage.text_hash).where(TargetPage.text_hash.is_not(None)))
             
         session.commit()
+        response_cache.invalidate()
         return JSONResponse(content={"message": "Source page and related target pages deleted"}, status_code=200)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
@@ -1,13 +1,22 @@
 from celery import Celery
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_init, worker_process_shutdown
+from celery.utils.time import get_exponential_backoff_interval
 from openai import OpenAI
 from app.internal.secrets import settings
 from app.internal.db_setup import engine
-from sqlmodel import Session, select
+from sqlmodel import Session, select, func
 from app.internal.models import SourcePage, TargetPage
 import uuid
 from app.crawler.run_spider import run_spider
+from app.crawler.relevance import RelevanceScorer, TRANSIENT_LLM_ERRORS
 import logging
+import os
+import time
 from datetime import datetime
+from app.internal import metrics, fair_share, blobstore
+from app.internal.cache import response_cache
+from app.internal.checkpoint import JobCheckpoint
 logging.getLogger("child").propagate = False # removes celery duplicate logs 
 
 
@@ -16,60 +25,144 @@ app.config_from_object('app.celeryconfig')
 
 chat_client=OpenAI(api_key=settings.OPENAI_API_KEY)
 
+MAX_RETRIES = 5
+RETRY_BACKOFF = 10 # seconds, doubled on every retry
+RETRY_BACKOFF_MAX = 300
 
-@app.task(bind=True) # bind allows accessing of self
-def scrape_and_store(self, url:str,target_keywords:list | None = None):
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    """ the worker has no web server so it exposes its metrics on METRICS_PORT """
+    metrics.start_exporter(settings.METRICS_PORT)
+
+
+@worker_process_shutdown.connect
+def release_process_metrics(pid=None, **kwargs):
+    metrics.mark_process_dead(pid or os.getpid())
+
+
+class TransientCrawlError(Exception):
+    """ the crawl hit errors that are likely to pass (network, OpenAI rate limits), retry from the checkpoint """
+
+
+def start_job(task_id: uuid.UUID, url: str) -> int:
+    """ create the SourcePage on the first run or pick it back up on a retry, returns the attempt number """
+    with Session(engine) as session:
+        source_page = session.get(SourcePage, task_id)
+        if source_page is None:
+            source_page = SourcePage(
+                uid=task_id,
+                url=url,
+                status='PENDING',
+                created_at=datetime.utcnow()) # set to pending when creating task
+        source_page.attempts = (source_page.attempts or 0) + 1
+        session.add(source_page)
+        session.commit()
+        return source_page.attempts
+
+
+def finish_job(task_id: uuid.UUID, status: str, timings: dict | None = None):
+    """ set the job status, adding this run's timings to those of earlier attempts """
+    with Session(engine) as session:
+        source_page = session.get(SourcePage, task_id)
+        if source_page is None:
+            return
+        source_page.status = status
+        if timings:
+            totals = dict(source_page.timings or {})
+            for stage, seconds in timings.items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+            source_page.timings = totals
+        session.add(source_page)
+        session.commit()
+    # nothing to invalidate: responses about a job are only cached once its row is COMPLETE or FAILED
+
+
+def backoff(retries: int) -> float:
+    return get_exponential_backoff_interval(
+        factor=RETRY_BACKOFF,
+        retries=retries,
+        maximum=RETRY_BACKOFF_MAX,
+        full_jitter=True
+    )
+
+
+def count_targets(task_id: uuid.UUID) -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(TargetPage).where(TargetPage.job_uid == task_id)).one()
+
+
+@app.task(bind=True, max_retries=MAX_RETRIES) # bind allows accessing of self
+def scrape_and_store(self, url:str,target_keywords:list | None = None, tenant:str | None = None):
     """ scrape a url and store the results in the database 
         target_keywords is a list of keywords to search for in the text
         if not provided, will use the default keywords from the settings
+        tenant is released from the fair share counters once the job is finished
+
+        progress is checkpointed as pages are scored, so a retry (after CLOSESPIDER_TIMEOUT or a
+        transient error) or a redelivery (worker killed, task_time_limit) resumes the crawl instead of starting over
     """
+    job_start = time.perf_counter()
+    task_id = uuid.UUID(self.request.id) # this is the celery generated UUID we can use to index the task once completed 
+    attempt = start_job(task_id, url)
+    if attempt > MAX_RETRIES + 1:
+        # redelivered too many times, every run was killed before it could fail cleanly
+        finish_job(task_id, "FAILED")
+        fair_share.release(tenant)
+        raise RuntimeError(f"job {task_id} gave up after {attempt - 1} attempts")
+
+    timings = {}
     try:
-        task_id = uuid.UUID(self.request.id) # this is the celery generated UUID we can use to index the task once completed 
+        crawl_start = time.perf_counter()
+        timings, transient_errors = run_spider(url,target_keywords,job_uid=task_id)
+        timings["crawl"] = time.perf_counter() - crawl_start
+        if transient_errors:
+            raise TransientCrawlError("; ".join(transient_errors[:5]))
+        pending = JobCheckpoint(task_id).pending_urls()
+        if pending:
+            # the crawl ended without visiting or giving up on these, don't report the job complete without them
+            raise TransientCrawlError(f"{len(pending)} frontier urls left undone")
+    except (TransientCrawlError, SoftTimeLimitExceeded) as e:
+        if self.request.retries >= self.max_retries:
+            finish_job(task_id, "FAILED", timings)
+            fair_share.release(tenant)
+            metrics.JOB_DURATION.labels(status="failed").observe(time.perf_counter() - job_start)
+            raise
+        finish_job(task_id, "RETRYING", timings)
+        metrics.JOB_DURATION.labels(status="retry").observe(time.perf_counter() - job_start)
+        raise self.retry(exc=e, countdown=backoff(self.request.retries))
+    except Exception:
+        finish_job(task_id, "FAILED", timings)
+        fair_share.release(tenant)
+        metrics.JOB_DURATION.labels(status="failed").observe(time.perf_counter() - job_start)
+        raise
 
-        p = SourcePage(
-                uid = task_id, 
-                url=url,
-                status='PENDING',
-                created_at=datetime.utcnow()) # set to pending when creating task 
-        with Session(engine) as session:
-            session.add(p)
-            session.commit() 
-        
-        # will make adjustable in the future
-  
-        results = run_spider(url,target_keywords)
-
-        with Session(engine) as session:
-            source_page = session.exec(select(SourcePage).filter(SourcePage.uid==task_id)).first() # should only be one unless uuid collide 
-            if not source_page:
-                raise Exception
-            source_page.status="COMPLETE"
-
-            for result in results:
-                item = TargetPage(
-                    id= uuid.uuid4(),
-                    job_uid=task_id,
-                    target_url= result["url"],
-                    file_type=result["file_type"],
-                    relevance_score=result["relevance_score"],
-                    matched_keywords=result["keywords"],
-                    text=result["text"],
-                    created_at=datetime.utcnow()
-                )
-                if item.relevance_score >1: #filter out noise immediately
-                    session.add(item)
-
-            session.commit()
-            
-        return {"status": "success", "result_count": len(results)}
-
-
-    except Exception as e:
-        with Session(engine) as session:
-            source_page = session.exec(select(SourcePage).filter(SourcePage.uid == task_id)).first()
-        if source_page:
-            source_page.status = "FAILED"
-            session.commit()
-        return {"status": "failed", "error": str(e)}
+    finish_job(task_id, "COMPLETE", timings)
+    fair_share.release(tenant)
+    metrics.JOB_DURATION.labels(status="success").observe(time.perf_counter() - job_start)
+    return {"status": "success", "result_count": count_targets(task_id)}
 
 
+@app.task(bind=True, max_retries=MAX_RETRIES)
+def rescore_job(self, job_uid:str, target_keywords:list | None = None):
+    """ re-rank the target pages a job already stored against new keywords, without crawling again
+        routed to the rescore queue, see celeryconfig
+    """
+    scorer = RelevanceScorer(target_keywords, chat_client)
+    with Session(engine) as session:
+        pages = session.exec(select(TargetPage).where(TargetPage.job_uid == uuid.UUID(job_uid))).all()
+        texts = blobstore.get_texts(session, [page.text_hash for page in pages])
+        for page in pages:
+            text = texts.get(page.text_hash)
+            if not text:
+                continue
+            try:
+                page.relevance_score = scorer.rank_relevance(text[:4000], page.target_url) # same cap as the spider
+            except TRANSIENT_LLM_ERRORS as e:
+                session.commit() # keep what was rescored so far
+                raise self.retry(exc=e, countdown=backoff(self.request.retries))
+            page.matched_keywords = scorer.extract_keywords(text)
+            session.add(page)
+        session.commit()
+    response_cache.invalidate()
+    return {"status": "success", "result_count": len(pages)}
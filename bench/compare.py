@@ -0,0 +1,58 @@
+"""
+Compare two benchmark reports and flag regressions.
+
+    python -m bench.compare baseline.json candidate.json --threshold 0.1
+
+Exits with status 1 if any tracked metric got worse by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+# metric -> True if higher is better
+TRACKED = {
+    "pages_per_second": True,
+    "llm_calls_per_job": False,
+    "job_latency_p50": False,
+    "job_latency_p99": False,
+    "peak_worker_rss_kb": False,
+}
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[dict]:
+    rows = []
+    for metric, higher_is_better in TRACKED.items():
+        old = baseline["results"].get(metric)
+        new = candidate["results"].get(metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        rows.append({"metric": metric, "baseline": old, "candidate": new, "change": change, "regression": worse > threshold})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline.get("params") != candidate.get("params"):
+        print("warning: reports were run with different parameters", file=sys.stderr)
+
+    rows = compare(baseline, candidate, args.threshold)
+    print(f"{baseline.get('commit')} -> {candidate.get('commit')}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['metric']:<22} {row['baseline']:>12.3f} {row['candidate']:>12.3f} {row['change']:>+8.1%}{flag}")
+    sys.exit(1 if any(row["regression"] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Local stand-in for the OpenAI completions api with tunable latency.
+
+Point the spider at it with OPENAI_BASE_URL=<base_url>/v1. Scores are derived from
+the prompt so the same page always gets the same relevance.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import random
+import threading
+import time
+
+
+class FakeOpenAIServer:
+
+    def __init__(self, latency: float = 0.2, error_rate: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate # share of calls answered with a 429
+        self.calls = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def complete(self, request: dict) -> dict:
+        prompt = request.get("prompt", "")
+        digest = hashlib.sha256(prompt.encode()).digest()
+        score = 1 + digest[0] % 10 # 1-10
+        prompt_tokens = len(prompt) // 4 # rough chars per token
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+        return {
+            "id": f"cmpl-{digest.hex()[:24]}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"text": f" {score}", "index": 0, "logprobs": None, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 2, "total_tokens": prompt_tokens + 2},
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.endswith("/completions"):
+                    self.send_error(404)
+                    return
+                time.sleep(server.latency)
+                if random.random() < server.error_rate:
+                    with server._lock:
+                        server.rate_limited += 1
+                    body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode()
+                    self.send_response(429)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                body = json.dumps(server.complete(request)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,145 @@
+"""
+Micro benchmark of link extraction on very large index pages.
+
+Compares the old two CSS passes zipped together with the single pass extractor in
+app/crawler/links.py, on a generated page where some anchors wrap their text in other
+elements, some have none and some urls repeat. Besides the time per page it reports how
+many hrefs the old approach paired with another anchor's text.
+
+It also checks that the extractor's concatenation shortcut for plain relative hrefs resolves
+them like resolve_href does, over awkward hrefs and base urls, and exits non-zero if not.
+
+    python -m bench.link_extraction --anchors 20000 --repeat 5
+"""
+from app.crawler.links import extract_links, resolve_href
+from scrapy.http import HtmlResponse
+from urllib.parse import urljoin
+import argparse
+import json
+import random
+import statistics
+import time
+
+BASE_URL = "http://bench.local/index.html"
+
+# hrefs around the edges of the shortcut: empty and dot segments, network paths, escapes, queries
+CHECK_HREFS = (
+    "a", "a/b", "a/", "/a", "/", "a//b", "/a//b", "a///b", "//other.local/a", "///a",
+    ".", "..", "./a", "../a", "a/./b", "a/../b", ".a", "a/.b", "a..b", "a.", "...",
+    "", "#", "#f", "a#f", "a?b=1", "?b=1", "a b", " a ", "a%20b", "%7Ea", "~a", "A/B", "-._~",
+    "a:b", "mailto:a@b.local", "javascript:void(0)", "HTTP://Other.Local/A",
+)
+CHECK_BASES = (
+    BASE_URL,
+    "http://bench.local",
+    "http://bench.local/dir/sub/page",
+    "https://Bench.Local:443/Dir%7E/page.html?x=1#top",
+    "http://bench.local/a//b/page",
+    "http://bench.local/a/./b/../c/page",
+    "http://bench.local/.a/page",
+)
+
+
+def render_index(anchors: int, seed: int) -> tuple[bytes, dict[str, str]]:
+    """
+    Returns:
+        tuple[bytes, dict[str, str]]: The page, and the anchor text each absolute href really has.
+    """
+    rng = random.Random(seed)
+    expected = {}
+    rows = []
+    for i in range(anchors):
+        href = f"/docs/{rng.randrange(anchors)}.html" if rng.random() < 0.1 else f"/docs/{i}.html"
+        kind = rng.random()
+        if kind < 0.1:
+            text, anchor = "", f'<a href="{href}"><img src="/i/{i}.png"></a>' # icon link, no text
+        elif kind < 0.3:
+            text, anchor = f"Budget {i}", f'<a href="{href}"><span>Budget</span> {i}</a>'
+        else:
+            text, anchor = f"Report {i}", f'<a href="{href}">Report {i}</a>'
+        url = urljoin(BASE_URL, href)
+        if not expected.get(url): # a repeated url is known by its first non-empty anchor text
+            expected[url] = text
+        rows.append(f"<li>Fiscal year {2000 + i % 25}: {anchor} (pdf)</li>")
+    body = f"<html><head><title>Index</title></head><body><ul>{''.join(rows)}</ul></body></html>"
+    return body.encode(), expected
+
+
+def legacy_extract(response: HtmlResponse) -> list[tuple[str, str]]:
+    """ what HighValueLinkSpider.parse did before the single pass extractor """
+    links = response.css('a::attr(href)').getall()
+    link_texts = response.css('a::text').getall()
+    pairs = {}
+    for link, text in zip(links, link_texts):
+        pairs.setdefault(urljoin(response.url, link), text)
+    return list(pairs.items())
+
+
+def single_pass_extract(response: HtmlResponse) -> list[tuple[str, str]]:
+    return [(link.url, link.text) for link in extract_links(response)]
+
+
+def time_extractor(extract, body: bytes, repeat: int) -> tuple[list[float], list[tuple[str, str]]]:
+    # a fresh response each round so the parse is timed too, like a crawl would pay for it
+    times, pairs = [], []
+    for _ in range(repeat):
+        response = HtmlResponse(url=BASE_URL, body=body, encoding="utf-8")
+        start = time.perf_counter()
+        pairs = extract(response)
+        times.append(time.perf_counter() - start)
+    return times, pairs
+
+
+def mispaired(pairs: list[tuple[str, str]], expected: dict[str, str]) -> int:
+    return sum(1 for url, text in pairs if " ".join(text.split()) != expected.get(url, text))
+
+
+def resolver_mismatches() -> list[dict[str, str]]:
+    """ hrefs the extractor resolves differently from resolve_href, each href as the only anchor of a page """
+    mismatches = []
+    for base in CHECK_BASES:
+        for href in CHECK_HREFS:
+            body = f'<html><body><a href="{href}">x</a></body></html>'.encode()
+            response = HtmlResponse(url=base, body=body, encoding="utf-8")
+            got, expected = extract_links(response)[0].url, resolve_href(base, href)
+            if got != expected:
+                mismatches.append({"base": base, "href": href, "extracted": got, "expected": expected})
+    return mismatches
+
+
+def run(args) -> dict:
+    body, expected = render_index(args.anchors, args.seed)
+    results = {}
+    for name, extract in (("legacy", legacy_extract), ("single_pass", single_pass_extract)):
+        times, pairs = time_extractor(extract, body, args.repeat)
+        results[name] = {
+            "seconds_median": statistics.median(times),
+            "seconds_min": min(times),
+            "links": len(pairs),
+            "mispaired": mispaired(pairs, expected),
+        }
+    legacy, single = results["legacy"]["seconds_median"], results["single_pass"]["seconds_median"]
+    return {
+        "params": {"anchors": args.anchors, "page_bytes": len(body), "repeat": args.repeat, "seed": args.seed},
+        "results": {**results, "speedup": legacy / single if single else 0.0},
+        "resolver_mismatches": resolver_mismatches(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Link extraction benchmark on a large generated index page")
+    parser.add_argument("--anchors", type=int, default=20000, help="anchors on the index page")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    report = run(parse_args(argv))
+    print(json.dumps(report, indent=2))
+    if report["resolver_mismatches"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
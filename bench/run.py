@@ -0,0 +1,185 @@
+"""
+End to end benchmark: POST /api/tasks/urls/batch -> celery -> HighValueLinkSpider -> database,
+against the synthetic site and the fake completions server.
+
+Needs a Redis broker (REDIS_URL) that no other worker is listening on, everything else
+runs locally. Results are printed (or written with --output) as JSON so runs on different
+commits can be compared with `python -m bench.compare`.
+
+    REDIS_URL=redis://localhost:6379/15 python -m bench.run --sites 8 --fanout 40 --output bench.json
+"""
+from bench.fake_openai import FakeOpenAIServer
+from bench.site import SiteServer, SiteSpec
+from dataclasses import asdict
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TERMINAL_STATUSES = {"COMPLETE", "FAILED"}
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_worker(env: dict, concurrency: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "celery", "-A", "app.tasks", "worker",
+         "--loglevel=warning", f"--concurrency={concurrency}"],
+        cwd=REPO_ROOT,
+        env=env,
+    )
+
+
+def wait_for_worker(celery_app, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if celery_app.control.ping(timeout=1):
+            return
+    raise TimeoutError("celery worker did not come up")
+
+
+def run(args) -> dict:
+    if not os.environ.get("REDIS_URL"):
+        raise SystemExit("REDIS_URL must point at a dedicated redis database for the benchmark")
+
+    spec = SiteSpec(
+        sites=args.sites,
+        fanout=args.fanout,
+        pdf_ratio=args.pdf_ratio,
+        slow_ratio=args.slow_ratio,
+        slow_delay=args.slow_delay,
+        seed=args.seed,
+    )
+    site = SiteServer(spec).start()
+    llm = FakeOpenAIServer(latency=args.llm_latency, error_rate=args.llm_error_rate).start()
+    workdir = tempfile.mkdtemp(prefix="raven-bench-")
+
+    # the api below and the worker subprocess read these at import time
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": llm.base_url,
+        "METRICS_PORT": str(args.metrics_port),
+    })
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.tasks import app as celery_app
+
+    celery_app.control.purge()
+    worker = start_worker(dict(os.environ), args.concurrency)
+    try:
+        wait_for_worker(celery_app, args.startup_timeout)
+        client = TestClient(app)
+
+        started = time.monotonic()
+        response = client.post("/api/tasks/urls/batch", json={"urls": site.seed_urls()})
+        response.raise_for_status()
+        submitted = time.monotonic()
+        pending = set(response.json()["task_ids"])
+
+        latencies = {}
+        statuses = {}
+        deadline = submitted + args.timeout
+        while pending and time.monotonic() < deadline:
+            for task_id in list(pending):
+                status = client.get(f"/api/tasks/{task_id}").json()["status"]
+                if status in TERMINAL_STATUSES:
+                    latencies[task_id] = time.monotonic() - submitted
+                    statuses[status] = statuses.get(status, 0) + 1
+                    pending.discard(task_id)
+            time.sleep(args.poll_interval)
+        elapsed = time.monotonic() - started
+    finally:
+        worker.terminate()
+        worker.wait()
+        site.stop()
+        llm.stop()
+
+    jobs = len(latencies) + len(pending)
+    job_latencies = list(latencies.values())
+    # RUSAGE_CHILDREN covers the worker and the recycled pool processes it reaped, in KiB on linux
+    peak_worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak_harness_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "params": {
+            **{k: v for k, v in asdict(spec).items() if k != "slow_sites"},
+            "llm_latency": args.llm_latency,
+            "llm_error_rate": args.llm_error_rate,
+            "concurrency": args.concurrency,
+        },
+        "results": {
+            "jobs": jobs,
+            "timed_out": len(pending),
+            "statuses": statuses,
+            "elapsed_seconds": elapsed,
+            "pages_fetched": site.pages_served,
+            "pages_per_second": site.pages_served / elapsed if elapsed else 0.0,
+            "llm_calls": llm.calls,
+            "llm_calls_per_job": llm.calls / jobs if jobs else 0.0,
+            "llm_rate_limited": llm.rate_limited,
+            "llm_prompt_tokens": llm.prompt_tokens,
+            "job_latency_p50": percentile(job_latencies, 50),
+            "job_latency_p99": percentile(job_latencies, 99),
+            "job_latency_mean": statistics.fmean(job_latencies) if job_latencies else 0.0,
+            "peak_worker_rss_kb": peak_worker_rss,
+            "peak_harness_rss_kb": peak_harness_rss,
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End to end crawl benchmark against a synthetic site")
+    parser.add_argument("--sites", type=int, default=4, help="number of seed sites, one job each")
+    parser.add_argument("--fanout", type=int, default=25, help="links on each seed page")
+    parser.add_argument("--pdf-ratio", type=float, default=0.1, help="share of links pointing at PDFs")
+    parser.add_argument("--slow-ratio", type=float, default=0.25, help="share of sites that respond slowly")
+    parser.add_argument("--slow-delay", type=float, default=0.3, help="seconds added to slow site responses")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake completion")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake completions answered with a 429")
+    parser.add_argument("--concurrency", type=int, default=4, help="celery worker concurrency")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the site graph")
+    parser.add_argument("--timeout", type=float, default=900, help="seconds to wait for all jobs")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--metrics-port", type=int, default=9809, help="worker exporter port, kept off the default")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
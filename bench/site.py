@@ -0,0 +1,155 @@
+"""
+Synthetic website graph served from localhost so crawls are reproducible and offline.
+
+Every site has an index page (the seed) that links to `fanout` pages, each of which
+links on to a few siblings. A share of the links point at PDFs, a share of the sites
+are slow to respond, and the index pages mix in navigation and image links that the
+spider is expected to filter out.
+"""
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import threading
+import time
+
+KEYWORDS = [
+    "Budget", "ACFR", "Fiscal Year", "Audit", "Treasurer", "Revenue",
+    "Debt Service", "Fund Balance", "Capital Improvement Plan", "General Fund",
+]
+FILLER = (
+    "The council met on Tuesday to review the quarterly report and discuss the "
+    "schedule for upcoming public meetings across the county offices. "
+)
+NAV_LINKS = [("/contact", "Contact us"), ("/privacy", "Privacy policy"), ("/logo.png", "Logo")]
+
+
+@dataclass
+class SiteSpec:
+    sites: int = 4
+    fanout: int = 25
+    pdf_ratio: float = 0.1
+    slow_ratio: float = 0.25
+    slow_delay: float = 0.3 # seconds added to every response of a slow site
+    paragraphs: int = 12
+    seed: int = 1
+    slow_sites: set = field(default_factory=set, init=False)
+
+    def __post_init__(self):
+        rng = random.Random(self.seed)
+        self.slow_sites = set(rng.sample(range(self.sites), round(self.sites * self.slow_ratio)))
+
+
+def page_is_pdf(spec: SiteSpec, site: int, page: int) -> bool:
+    return random.Random(f"{spec.seed}:{site}:{page}:pdf").random() < spec.pdf_ratio
+
+
+def render_index(spec: SiteSpec, site: int) -> bytes:
+    links = []
+    for page in range(spec.fanout):
+        extension = ".pdf" if page_is_pdf(spec, site, page) else ".html"
+        keyword = KEYWORDS[(site + page) % len(KEYWORDS)]
+        links.append(f'<li><a href="/site{site}/page{page}{extension}">{keyword} document {page}</a></li>')
+    links.extend(f'<li><a href="/site{site}{href}">{text}</a></li>' for href, text in NAV_LINKS)
+    return (
+        f"<html><head><title>Site {site}</title></head><body>"
+        f"<h1>Finance department {site}</h1><ul>{''.join(links)}</ul></body></html>"
+    ).encode()
+
+
+def render_page(spec: SiteSpec, site: int, page: int) -> bytes:
+    rng = random.Random(f"{spec.seed}:{site}:{page}")
+    paragraphs = []
+    for _ in range(spec.paragraphs):
+        words = rng.sample(KEYWORDS, 2) if rng.random() < 0.5 else []
+        paragraphs.append(f"<p>{FILLER * 2}{' '.join(words)}</p>")
+    siblings = "".join(
+        f'<a href="/site{site}/page{rng.randrange(spec.fanout)}.html">Related report</a> '
+        for _ in range(3)
+    )
+    return (
+        f"<html><head><title>Page {page}</title></head><body><article>"
+        f"<h1>Report {page}</h1>{''.join(paragraphs)}</article><nav>{siblings}</nav></body></html>"
+    ).encode()
+
+
+def render_pdf(site: int, page: int) -> bytes:
+    text = f"Annual Budget report {site}-{page}"
+    stream = f"BT /F1 12 Tf 72 712 Td ({text}) Tj ET".encode()
+    return (
+        b"%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+        b"2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n"
+        b"3 0 obj << /Type /Page /Parent 2 0 R /Contents 4 0 R >> endobj\n"
+        + f"4 0 obj << /Length {len(stream)} >> stream\n".encode() + stream
+        + b"\nendstream endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n"
+    )
+
+
+class SiteServer:
+    """ serves a SiteSpec on a background thread, counts the pages it serves """
+
+    def __init__(self, spec: SiteSpec, host: str = "127.0.0.1", port: int = 0):
+        self.spec = spec
+        self.pages_served = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def seed_urls(self) -> list[str]:
+        return [f"{self.base_url}/site{site}/" for site in range(self.spec.sites)]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def route(self, path: str):
+        """ returns (status, content type, body) for a request path """
+        if path == "/robots.txt":
+            return 200, "text/plain", b"User-agent: *\nAllow: /\n"
+        parts = path.strip("/").split("/")
+        if not parts[0].startswith("site") or not parts[0][4:].isdigit():
+            return 404, "text/plain", b"not found"
+        site = int(parts[0][4:])
+        if site >= self.spec.sites:
+            return 404, "text/plain", b"not found"
+        if len(parts) == 1:
+            return 200, "text/html", render_index(self.spec, site)
+        name = parts[1]
+        if name.startswith("page") and name.endswith((".html", ".pdf")):
+            page = int(name[4:].rsplit(".", 1)[0])
+            if name.endswith(".pdf"):
+                return 200, "application/pdf", render_pdf(site, page)
+            return 200, "text/html", render_page(self.spec, site, page)
+        return 200, "text/html", b"<html><body><p>Navigation page</p></body></html>"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = server.route(self.path)
+                site = self.path.strip("/").split("/")[0]
+                if site[4:].isdigit() and int(site[4:]) in server.spec.slow_sites:
+                    time.sleep(server.spec.slow_delay)
+                if self.path != "/robots.txt":
+                    with server._lock:
+                        server.pages_served += 1
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler